@@ -0,0 +1,147 @@
+"""
+Benchmarks for the TransactionStore.
+
+    python benchmark.py dates     # text dates vs integer day numbers
+    python benchmark.py coalesce  # concurrent identical reads
+"""
+
+from __future__ import annotations
+
+import datetime
+import pathlib
+import sqlite3
+import sys
+import tempfile
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+from htmx_fastapi.coalescingstore import CoalescingTransactionStore
+from htmx_fastapi.transaction import Transaction
+from htmx_fastapi.transactionstore import TransactionStore
+from mock_database import NUMBER_OF_DAYS, _generate_transactions
+
+QUERY_REPEAT = 200
+CONCURRENT_TABS = 32
+TABLE_UPDATES = 50
+
+
+def _database_size(database: sqlite3.Connection) -> int:
+    """Return the size of the database in bytes."""
+    page_count = database.execute("PRAGMA page_count").fetchone()[0]
+    page_size = database.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def _text_database(path: pathlib.Path, transactions: list[Transaction]) -> None:
+    """Build the pre-migration layout: YYYY-MM-DD text dates with a date index."""
+    database = sqlite3.connect(path)
+    database.execute(
+        """CREATE TABLE transactions (
+            tid INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT,
+            description TEXT,
+            amount INTEGER
+        )"""
+    )
+    database.execute("CREATE INDEX transactions_date ON transactions (date)")
+    database.executemany(
+        "INSERT INTO transactions (date, description, amount) VALUES (?, ?, ?)",
+        [(str(t.date), t.description, t.amount) for t in transactions],
+    )
+    database.commit()
+    database.execute("VACUUM")
+    database.close()
+
+
+def _time_range_queries(
+    database: sqlite3.Connection,
+    since: str | int,
+    until: str | int,
+) -> float:
+    """Return seconds to run the TransactionStore range queries."""
+
+    def _query() -> None:
+        for sql in (
+            "SELECT tid, amount, description, date FROM transactions",
+            "SELECT SUM(amount) FROM transactions",
+            "SELECT COUNT(amount) FROM transactions",
+        ):
+            sql = f"{sql} WHERE date >= ? AND date <= ?"
+            database.execute(sql, (since, until)).fetchall()
+
+    return timeit.timeit(_query, number=QUERY_REPEAT)
+
+
+def compare_date_storage() -> None:
+    """Print the size and range query speed of both date layouts."""
+    transactions = _generate_transactions(NUMBER_OF_DAYS)
+    until = transactions[-1].date
+    since = until - datetime.timedelta(days=90)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = pathlib.Path(tempdir, "transactions.db")
+        _text_database(path, transactions)
+
+        database = sqlite3.connect(path)
+        text_size = _database_size(database)
+        text_seconds = _time_range_queries(database, str(since), str(until))
+
+        # Opening the store migrates the text layout in place
+        TransactionStore(database)
+        database.execute("VACUUM")
+        integer_size = _database_size(database)
+        integer_seconds = _time_range_queries(
+            database, since.toordinal(), until.toordinal()
+        )
+        database.close()
+
+    print(f"{len(transactions)} transactions, {QUERY_REPEAT} x 90 day range queries")
+    print(f"text dates:    {text_size:>9} bytes {text_seconds:.3f}s")
+    print(f"integer dates: {integer_size:>9} bytes {integer_seconds:.3f}s")
+
+
+def _fan_out(store: TransactionStore) -> float:
+    """Return seconds for every tab to reload its range after each tableUpdate."""
+    until = datetime.date.today()
+    since = until - datetime.timedelta(days=90)
+
+    def _reload() -> None:
+        store.get(since, until)
+        store.get_total(since, until)
+        store.get_count(since, until)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENT_TABS) as pool:
+        for _ in range(TABLE_UPDATES):
+            for future in [pool.submit(_reload) for _ in range(CONCURRENT_TABS)]:
+                future.result()
+
+    return time.perf_counter() - start
+
+
+def compare_coalescing() -> None:
+    """Print the time and coalesced reads of tabs reloading the same range."""
+    transactions = _generate_transactions(NUMBER_OF_DAYS)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = pathlib.Path(tempdir, "transactions.db")
+        database = sqlite3.connect(path, check_same_thread=False)
+        TransactionStore(database).add_batch(transactions)
+
+        plain_seconds = _fan_out(TransactionStore(database))
+        store = CoalescingTransactionStore(database)
+        coalesced_seconds = _fan_out(store)
+        database.close()
+
+    calls = store.executed + store.coalesced
+    print(f"{CONCURRENT_TABS} tabs x {TABLE_UPDATES} tableUpdates x 3 reads")
+    print(f"plain:      {plain_seconds:.3f}s {calls} queries")
+    print(f"coalescing: {coalesced_seconds:.3f}s {store.executed} queries")
+    print(f"coalesced {store.coalesced} of {calls} calls")
+
+
+if __name__ == "__main__":
+    benchmarks = {"dates": compare_date_storage, "coalesce": compare_coalescing}
+    for name in sys.argv[1:] or benchmarks:
+        benchmarks[name]()
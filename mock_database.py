@@ -35,7 +35,7 @@ def _generate_transactions(dayscount: int) -> list[Transaction]:
                 tid=0,
                 amount=random.randint(100, 10000),
                 description=" ".join(random.choices(words, k=5)),
-                date=date_start.strftime("%Y-%m-%d"),
+                date=date_start.date(),
             )
             transactions.append(transaction)
 
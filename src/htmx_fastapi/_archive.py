@@ -0,0 +1,39 @@
+"""Encoding for the compressed month-blocks of archived transactions."""
+
+from __future__ import annotations
+
+import datetime
+import json
+import lzma
+import zlib
+from collections.abc import Callable
+
+# Rows are (tid, amount, description, date) with the date as a day number
+CODECS: dict[str, tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+def encode(rows: list[tuple[int, int, str, int]], codec: str) -> bytes:
+    """Return the rows compressed with `codec`."""
+    compress, _ = CODECS[codec]
+    return compress(json.dumps(rows, separators=(",", ":")).encode())
+
+
+def decode(payload: bytes, codec: str) -> list[tuple[int, int, str, int]]:
+    """Return the rows of a payload compressed with `codec`."""
+    _, decompress = CODECS[codec]
+    return [tuple(row) for row in json.loads(decompress(payload))]
+
+
+def group_by_month(
+    rows: list[tuple[int, int, str, int]],
+) -> dict[str, list[tuple[int, int, str, int]]]:
+    """Return the rows grouped by their YYYY-MM month, keeping their order."""
+    months: dict[str, list[tuple[int, int, str, int]]] = {}
+    for row in rows:
+        month = datetime.date.fromordinal(row[3]).strftime("%Y-%m")
+        months.setdefault(month, []).append(row)
+
+    return months
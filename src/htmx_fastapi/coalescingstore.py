@@ -0,0 +1,99 @@
+"""TransactionStore that coalesces identical concurrent reads."""
+
+from __future__ import annotations
+
+import datetime
+import functools
+import sqlite3
+from collections.abc import Callable, Hashable, Iterator
+from contextlib import contextmanager
+from typing import TypeVar
+
+from ._singleflight import SingleFlight
+from .transaction import Transaction
+from .transactionstore import TransactionStore
+
+T = TypeVar("T")
+
+
+class CoalescingTransactionStore(TransactionStore):
+    """
+    Interface to the Transaction table sharing identical reads in flight.
+
+    Concurrent reads with the same arguments run one query and share its
+    result, which callers must treat as read-only. Each write starts a new
+    generation under the store lock before it commits, so a read begun
+    before the write is never handed to a caller arriving after the commit.
+    """
+
+    def __init__(self, database: sqlite3.Connection) -> None:
+        """Initialize the database interface."""
+        self._flight = SingleFlight()
+        self._generation = 0
+
+        super().__init__(database)
+
+    @property
+    def executed(self) -> int:
+        """Number of coalesced calls that ran."""
+        return self._flight.executed
+
+    @property
+    def coalesced(self) -> int:
+        """Number of calls answered by another call already in flight."""
+        return self._flight.coalesced
+
+    def coalesce(self, key: Hashable, func: Callable[[], T]) -> T:
+        """
+        Return `func()`, shared with concurrent calls for the same `key`.
+
+        Reads inside a batch see its uncommitted writes and are never shared.
+        """
+        if self._batch.depth:
+            return func()
+
+        return self._flight.do((self._generation, key), func)
+
+    def get(
+        self,
+        date_since: datetime.date,
+        date_until: datetime.date,
+    ) -> list[Transaction]:
+        """Get transactions in the database, see TransactionStore.get."""
+        read = functools.partial(super().get, date_since, date_until)
+        return self.coalesce(("get", date_since, date_until), read)
+
+    def get_total(
+        self,
+        date_since: datetime.date,
+        date_until: datetime.date,
+    ) -> int:
+        """Get the total amount of transactions, see TransactionStore.get_total."""
+        read = functools.partial(super().get_total, date_since, date_until)
+        return self.coalesce(("get_total", date_since, date_until), read)
+
+    def get_count(
+        self,
+        date_since: datetime.date,
+        date_until: datetime.date,
+    ) -> int:
+        """Get the number of transactions, see TransactionStore.get_count."""
+        read = functools.partial(super().get_count, date_since, date_until)
+        return self.coalesce(("get_count", date_since, date_until), read)
+
+    def get_count_all(self) -> int:
+        """Get the number of transactions, see TransactionStore.get_count_all."""
+        return self.coalesce(("get_count_all",), super().get_count_all)
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Apply every write made inside the context in one transaction."""
+        with super().batch():
+            yield
+            # Still holding the store lock, before the batch commits
+            self._generation += 1
+
+    def _commit(self) -> None:
+        """Start a new generation, then commit unless a batch is open."""
+        self._generation += 1
+        super()._commit()
@@ -1,74 +1,172 @@
 from __future__ import annotations
 
+import contextlib
+import dataclasses
 import datetime
 import decimal
+import itertools
 import sqlite3
-from typing import Annotated
+from collections.abc import AsyncIterator
+from typing import Annotated, Any
 
 import fastapi
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
 from . import _filters
+from .coalescingstore import CoalescingTransactionStore
+from .profiling import ProfiledRoute, ProfileMiddleware, ProfileStore, admin_router
+from .settings import Settings
 from .transaction import Transaction
-from .transactionstore import TransactionStore
 
-# Setup TransactionStore
-db = sqlite3.connect("transactions.db", check_same_thread=False)
-transaction_store = TransactionStore(db)
+DEFAULT_TRANSACTION_RANGE = 90
+BATCH_OPERATIONS = ("create", "update", "delete")
+BATCH_FIELDS = ("op", "tid", "date_time", "description", "amount")
+# Amounts are stored in cents as SQLite signed 64-bit integers
+AMOUNT_RANGE = range(-(2**63), 2**63)
 
-# Setup API and templates
-app = fastapi.FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
-template = Jinja2Templates(directory="template")
-_filters.apply_filters(template)
+router = fastapi.APIRouter(route_class=ProfiledRoute)
 
-DEFAULT_TRANSACTION_RANGE = 90
 
+async def _get_transaction_store(
+    request: fastapi.Request,
+) -> CoalescingTransactionStore:
+    """Return the TransactionStore opened by the application lifespan."""
+    return request.app.state.transaction_store
 
-def _get_valid_date(since: str | None, until: str | None) -> tuple[str, str]:
-    now = datetime.datetime.now(tz=datetime.timezone.utc)
-    default = DEFAULT_TRANSACTION_RANGE
-    if not since:
-        since = (now - datetime.timedelta(days=default)).strftime("%Y-%m-%d")
 
-    if not until:
-        until = now.strftime("%Y-%m-%d")
+async def _get_template(request: fastapi.Request) -> Jinja2Templates:
+    """Return the templates loaded by the application lifespan."""
+    return request.app.state.template
+
+
+Store = Annotated[CoalescingTransactionStore, fastapi.Depends(_get_transaction_store)]
+Template = Annotated[Jinja2Templates, fastapi.Depends(_get_template)]
+
+
+def _create_templates(directory: str) -> Jinja2Templates:
+    """Load templates, apply filters, and compile every template ahead of use."""
+    template = Jinja2Templates(directory=directory)
+    _filters.apply_filters(template)
+    for name in template.env.list_templates():
+        template.get_template(name)
+
+    return template
+
+
+def create_app(settings: Settings | None = None) -> fastapi.FastAPI:
+    """
+    Create the application, with settings from the environment if none given.
+
+    Nothing is opened here. The database connection, table migrations, and
+    template compilation happen in the lifespan startup, after any worker
+    processes have forked.
+    """
+    settings = settings or Settings.from_env()
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: fastapi.FastAPI) -> AsyncIterator[None]:
+        database = sqlite3.connect(settings.database, check_same_thread=False)
+        store = CoalescingTransactionStore(database)
+        if settings.archive_after_days is not None:
+            today = datetime.datetime.now(tz=datetime.timezone.utc).date()
+            store.archive(today - datetime.timedelta(days=settings.archive_after_days))
+
+        app.state.transaction_store = store
+        app.state.template = _create_templates(settings.template_directory)
+        try:
+            yield
+        finally:
+            database.close()
+
+    app = fastapi.FastAPI(lifespan=lifespan)
+    app.state.settings = settings
+    app.state.profiles = ProfileStore(settings.profile_history)
+    if settings.admin_token is not None:
+        app.add_middleware(
+            ProfileMiddleware,
+            admin_token=settings.admin_token,
+            profiles=app.state.profiles,
+        )
+    app.mount(
+        path="/static",
+        app=StaticFiles(directory=settings.static_directory, check_dir=False),
+        name="static",
+    )
+    app.include_router(router)
+    app.include_router(admin_router)
+
+    return app
+
+
+def _parse_date(value: str) -> datetime.date:
+    """
+    Parse a YYYY-MM-DD date from a request, defaulting to today if empty.
+
+    Raises:
+        HTTPException: The value is not a valid date
+    """
+    if not value:
+        return datetime.datetime.now(tz=datetime.timezone.utc).date()
+
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise fastapi.HTTPException(422, f"Invalid date '{value}', use YYYY-MM-DD")
+
 
-    return since, until
+def _get_valid_date(
+    since: str | None,
+    until: str | None,
+) -> tuple[datetime.date, datetime.date]:
+    """
+    Parse a date range from a request.
+
+    if `since` is empty, default DEFAULT_TRANSACTION_RANGE days ago
+    if `until` is empty, default now
+    """
+    now = datetime.datetime.now(tz=datetime.timezone.utc).date()
+    default = DEFAULT_TRANSACTION_RANGE
+    since_date = _parse_date(since) if since else now - datetime.timedelta(default)
+    until_date = _parse_date(until) if until else now
 
+    return since_date, until_date
 
-@app.get("/")
-def index(request: fastapi.Request) -> fastapi.Response:
+
+@router.get("/")
+def index(request: fastapi.Request, template: Template) -> fastapi.Response:
     return template.TemplateResponse("index.html", {"request": request})
 
 
-@app.get("/gridsample")
-def gridsample(request: fastapi.Request) -> fastapi.Response:
+@router.get("/gridsample")
+def gridsample(request: fastapi.Request, template: Template) -> fastapi.Response:
     return template.TemplateResponse("gridsample.html", {"request": request})
 
 
-@app.get("/favicon.ico", include_in_schema=False)
-def favicon() -> fastapi.Response:
-    return fastapi.responses.FileResponse("static/img/favicon.ico")
+@router.get("/favicon.ico", include_in_schema=False)
+def favicon(request: fastapi.Request) -> fastapi.Response:
+    static_directory = request.app.state.settings.static_directory
+    return fastapi.responses.FileResponse(f"{static_directory}/img/favicon.ico")
 
 
-@app.get("/transactions")
+@router.get("/transactions")
 def transactions(
     request: fastapi.Request,
+    template: Template,
     date_since: str | None = None,
     date_until: str | None = None,
 ) -> fastapi.Response:
     """Page view for transactions."""
-    date_since, date_until = _get_valid_date(date_since, date_until)
-    empty_transaction = Transaction(0, 0, "", date_until)
+    since, until = _get_valid_date(date_since, date_until)
+    empty_transaction = Transaction(0, 0, "", until)
     context = {
         "request": request,
-        "date_since": date_since,
-        "date_until": date_until,
+        "date_since": since,
+        "date_until": until,
         "transaction": empty_transaction,
     }
-    new_url = f"/transactions?date_since={date_since}&date_until={date_until}"
+    new_url = f"/transactions?date_since={since}&date_until={until}"
     headers = {
         "HX-Push-Url": new_url,
         "HX-Replace-Url": new_url,
@@ -77,9 +175,11 @@ def transactions(
     return template.TemplateResponse("transaction/index.html", context, headers=headers)
 
 
-@app.get("/transaction/table")
+@router.get("/transaction/table")
 def transaction_table(
     request: fastapi.Request,
+    transaction_store: Store,
+    template: Template,
     date_since: str | None = None,
     date_until: str | None = None,
 ) -> fastapi.Response:
@@ -89,29 +189,35 @@ def transaction_table(
     if `since` is None, default 90 days ago
     if `until` is None, default now
     """
-    date_since, date_until = _get_valid_date(date_since, date_until)
-    context = {
-        "request": request,
-        "transactions": transaction_store.get(date_since, date_until),
-        "date_since": date_since,
-        "date_until": date_until,
-    }
-    new_url = f"/transactions?date_since={date_since}&date_until={date_until}"
+    since, until = _get_valid_date(date_since, date_until)
+
+    def render() -> bytes:
+        context = {
+            "request": request,
+            "transactions": transaction_store.get(since, until),
+            "date_since": since,
+            "date_until": until,
+        }
+        response = template.TemplateResponse("transaction/partial/table.html", context)
+        return response.body
+
+    new_url = f"/transactions?date_since={since}&date_until={until}"
     headers = {
         "HX-Push-Url": new_url,
         "HX-Replace-Url": new_url,
     }
 
-    return template.TemplateResponse(
-        name="transaction/partial/table.html",
-        context=context,
-        headers=headers,
-    )
+    # Identical concurrent table requests share one query and one render
+    body = transaction_store.coalesce(("table", since, until), render)
+
+    return fastapi.responses.HTMLResponse(body, headers=headers)
 
 
-@app.get("/transaction/amounttotal")
+@router.get("/transaction/amounttotal")
 def amount_total(
     request: fastapi.Request,
+    transaction_store: Store,
+    template: Template,
     date_since: str | None = None,
     date_until: str | None = None,
 ) -> fastapi.Response:
@@ -121,18 +227,20 @@ def amount_total(
     if `since` is None, default 90 days ago
     if `until` is None, default now
     """
-    date_since, date_until = _get_valid_date(date_since, date_until)
+    since, until = _get_valid_date(date_since, date_until)
     context = {
         "request": request,
-        "total_amount": transaction_store.get_total(date_since, date_until),
+        "total_amount": transaction_store.get_total(since, until),
     }
 
     return template.TemplateResponse("transaction/partial/amounttotal.html", context)
 
 
-@app.get("/transaction/rowtotal")
+@router.get("/transaction/rowtotal")
 def transaction_count(
     request: fastapi.Request,
+    transaction_store: Store,
+    template: Template,
     date_since: str | None = None,
     date_until: str | None = None,
 ) -> fastapi.Response:
@@ -142,38 +250,91 @@ def transaction_count(
     if `since` is None, default 90 days ago
     if `until` is None, default now
     """
-    date_since, date_until = _get_valid_date(date_since, date_until)
+    since, until = _get_valid_date(date_since, date_until)
     context = {
         "request": request,
-        "total_displayed": transaction_store.get_count(date_since, date_until),
+        "total_displayed": transaction_store.get_count(since, until),
         "total_count": transaction_store.get_count_all(),
     }
 
     return template.TemplateResponse("transaction/partial/rowtotal.html", context)
 
 
-@app.get("/transaction/{transaction_id}")
+@router.get("/transaction/changes")
+def transaction_changes(
+    transaction_store: Store,
+    since_seq: int = 0,
+) -> dict[str, Any]:
+    """
+    Return transactions changed after `since_seq` as JSON.
+
+    When `resync` is true the journal no longer covers `since_seq` and the
+    client must re-read its full range.
+    """
+    # Read the sequence first so a concurrent write is re-sent, never skipped
+    seq = transaction_store.get_change_seq()
+    changes = transaction_store.get_changes(since_seq)
+
+    return {
+        "seq": seq,
+        "resync": since_seq < transaction_store.get_change_floor(),
+        "changes": [dataclasses.asdict(change) for change in changes],
+    }
+
+
+@router.post("/transaction/changes/{consumer}")
+def acknowledge_changes(
+    transaction_store: Store,
+    consumer: str,
+    seq: int,
+) -> dict[str, Any]:
+    """
+    Acknowledge every change up to `seq` for the named `consumer`.
+
+    Journal entries every consumer has acknowledged are compacted. A `seq`
+    past the current change sequence is clamped to it.
+    """
+    transaction_store.advance_consumer(consumer, seq)
+    compacted = transaction_store.compact_changes()
+
+    return {"consumer": consumer, "compacted": compacted}
+
+
+@router.get("/transaction/{transaction_id}")
 def transaction(
     request: fastapi.Request,
+    transaction_store: Store,
+    template: Template,
     transaction_id: int,
 ) -> fastapi.Response:
     """
     Return partial HTML for a single transaction.
     """
+    row = transaction_store.get_by_id(transaction_id)
+    if row is None:
+        raise fastapi.HTTPException(404, f"Transaction {transaction_id} not found")
+
     context = {
         "request": request,
-        "transaction": transaction_store.get_by_id(transaction_id),
+        "transaction": row,
     }
 
     return template.TemplateResponse("transaction/partial/row.html", context)
 
 
-@app.get("/transaction/{transaction_id}/edit")
-def edit_transaction(request: fastapi.Request, transaction_id: int) -> fastapi.Response:
+@router.get("/transaction/{transaction_id}/edit")
+def edit_transaction(
+    request: fastapi.Request,
+    transaction_store: Store,
+    template: Template,
+    transaction_id: int,
+) -> fastapi.Response:
     """
     Return partial HTML for editing a single transaction.
     """
     row = transaction_store.get_by_id(transaction_id)
+    if row is None:
+        raise fastapi.HTTPException(404, f"Transaction {transaction_id} not found")
 
     context = {
         "request": request,
@@ -183,9 +344,11 @@ def edit_transaction(request: fastapi.Request, transaction_id: int) -> fastapi.R
     return template.TemplateResponse("transaction/partial/row_edit.html", context)
 
 
-@app.put("/transaction/{transaction_id}")
+@router.put("/transaction/{transaction_id}")
 def update_transaction(
     request: fastapi.Request,
+    transaction_store: Store,
+    template: Template,
     transaction_id: int,
     date_time: Annotated[str, fastapi.Form()],
     description: Annotated[str, fastapi.Form()],
@@ -194,17 +357,17 @@ def update_transaction(
     """
     Update a single transaction.
     """
-    if not date_time:
-        date_time = datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y-%m-%d")
+    date = _parse_date(date_time)
 
     try:
         _amount = int(decimal.Decimal(amount) * 100)
     except ValueError:
         _amount = 0
 
-    transaction = Transaction(transaction_id, _amount, description, date_time)
+    transaction = Transaction(transaction_id, _amount, description, date)
 
-    transaction_store.update(transaction)
+    if not transaction_store.update(transaction):
+        raise fastapi.HTTPException(404, f"Transaction {transaction_id} not found")
 
     context = {
         "request": request,
@@ -219,22 +382,28 @@ def update_transaction(
     )
 
 
-@app.delete("/transaction/{transaction_id}")
+@router.delete("/transaction/{transaction_id}")
 def delete_transaction(
-    request: fastapi.Request, transaction_id: int
+    request: fastapi.Request,
+    transaction_store: Store,
+    transaction_id: int,
 ) -> fastapi.Response:
     """
     Delete a single transaction.
     """
-    transaction_store.delete(transaction_id)
+    if not transaction_store.delete(transaction_id):
+        raise fastapi.HTTPException(404, f"Transaction {transaction_id} not found")
+
     headers = {"HX-Trigger": "tableUpdate"}
 
     return fastapi.Response(status_code=200, headers=headers)
 
 
-@app.post("/transaction")
+@router.post("/transaction")
 def create_transaction(
     request: fastapi.Request,
+    transaction_store: Store,
+    template: Template,
     date_time: Annotated[str, fastapi.Form()],
     description: Annotated[str, fastapi.Form()],
     amount: Annotated[str, fastapi.Form()],
@@ -242,15 +411,14 @@ def create_transaction(
     """
     Create a transaction.
     """
-    if not date_time:
-        date_time = datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y-%m-%d")
+    date = _parse_date(date_time)
 
     try:
         _amount = int(decimal.Decimal(amount) * 100)
     except ValueError:
         _amount = 0
 
-    transaction = Transaction(0, _amount, description, date_time)
+    transaction = Transaction(0, _amount, description, date)
 
     transaction_store.add(transaction)
 
@@ -265,3 +433,171 @@ def create_transaction(
         context=context,
         headers=headers,
     )
+
+
+@dataclasses.dataclass(frozen=True)
+class _BatchOperation:
+    """A single operation of a batch mutation."""
+
+    op: str
+    transaction: Transaction
+
+
+def _parse_batch_operation(fields: dict[str, Any]) -> _BatchOperation:
+    """
+    Parse one operation of a batch mutation.
+
+    Raises:
+        HTTPException: A field of the operation is invalid
+    """
+    op = fields.get("op")
+    if op not in BATCH_OPERATIONS:
+        raise fastapi.HTTPException(422, f"Invalid op '{op}', use {BATCH_OPERATIONS}")
+
+    tid = 0
+    if op != "create":
+        raw_tid = fields.get("tid")
+        try:
+            if isinstance(raw_tid, bool) or not isinstance(raw_tid, (int, str)):
+                raise TypeError()
+            tid = int(raw_tid)
+        except (TypeError, ValueError):
+            raise fastapi.HTTPException(422, f"Invalid tid '{raw_tid}'")
+
+    if op == "delete":
+        return _BatchOperation(op, Transaction(tid, 0, ""))
+
+    amount = str(fields.get("amount") or 0)
+    try:
+        _amount = int(decimal.Decimal(amount) * 100)
+    except (ValueError, ArithmeticError):
+        raise fastapi.HTTPException(422, f"Invalid amount '{amount}'")
+    if _amount not in AMOUNT_RANGE:
+        raise fastapi.HTTPException(422, f"Amount '{amount}' is out of range")
+
+    description = fields.get("description") or ""
+    if not isinstance(description, str):
+        raise fastapi.HTTPException(422, f"Invalid description '{description}'")
+
+    date = _parse_date(str(fields.get("date_time") or ""))
+
+    return _BatchOperation(op, Transaction(tid, _amount, description, date))
+
+
+async def _read_batch(request: fastapi.Request) -> list[dict[str, Any]]:
+    """
+    Read the operations of a batch mutation from a JSON or form body.
+
+    JSON is a list of operations, or an object with an "operations" list. A
+    form repeats every field of BATCH_FIELDS once per operation, in order.
+
+    Raises:
+        HTTPException: The body is not a list of operations
+    """
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise fastapi.HTTPException(422, "Body is not valid JSON")
+        operations = body.get("operations") if isinstance(body, dict) else body
+        if not isinstance(operations, list) or not all(
+            isinstance(operation, dict) for operation in operations
+        ):
+            raise fastapi.HTTPException(422, "Expected a list of operations")
+        return operations
+
+    form = await request.form()
+    columns = [form.getlist(field) for field in BATCH_FIELDS]
+    if len({len(column) for column in columns}) > 1:
+        raise fastapi.HTTPException(422, f"Repeat each of {BATCH_FIELDS} per row")
+
+    return [dict(zip(BATCH_FIELDS, row)) for row in zip(*columns)]
+
+
+class _RollbackBatch(Exception):
+    """Raised to roll back a batch mutation that could not be applied in full."""
+
+
+def _apply_batch(
+    transaction_store: CoalescingTransactionStore,
+    operations: list[_BatchOperation],
+) -> list[dict[str, Any]]:
+    """
+    Apply the operations in order within one database transaction.
+
+    Consecutive operations of the same kind go through one batch call. Returns
+    the tid and status of each operation. Nothing is applied if an update or
+    delete does not find its transaction.
+    """
+    results: list[dict[str, Any]] = []
+    grouped = itertools.groupby(operations, key=lambda operation: operation.op)
+
+    try:
+        with transaction_store.batch():
+            for op, group in grouped:
+                transactions = [operation.transaction for operation in group]
+                tids = [transaction.tid for transaction in transactions]
+
+                if op == "create":
+                    tids = transaction_store.add_batch(transactions)
+                    found = [True] * len(tids)
+                elif op == "update":
+                    found = transaction_store.update_batch(transactions)
+                else:
+                    found = transaction_store.delete_batch(tids)
+
+                for tid, was_found in zip(tids, found):
+                    status = "ok" if was_found else "not_found"
+                    results.append({"op": op, "tid": tid, "status": status})
+
+            if any(result["status"] != "ok" for result in results):
+                raise _RollbackBatch()
+
+    except _RollbackBatch:
+        for result in results:
+            if result["status"] == "ok":
+                result["status"] = "skipped"
+
+    return results
+
+
+@router.post("/transaction/batch")
+async def batch_transactions(
+    request: fastapi.Request,
+    transaction_store: Store,
+) -> fastapi.Response:
+    """
+    Create, update, and delete many transactions atomically.
+
+    Every operation is applied, in order, or none are. Returns the status of
+    each operation and, once applied, a single tableUpdate trigger. A body
+    that is not a list of operations, or holds none, is rejected with 422.
+    """
+    rows = await _read_batch(request)
+    if not rows:
+        raise fastapi.HTTPException(422, "Expected at least one operation")
+
+    operations: list[_BatchOperation] = []
+    results: list[dict[str, Any]] = []
+    for fields in rows:
+        result = {"op": fields.get("op"), "status": "skipped"}
+        try:
+            operations.append(_parse_batch_operation(fields))
+        except fastapi.HTTPException as error:
+            result.update(status="invalid", detail=error.detail)
+        results.append(result)
+
+    if any(result["status"] == "invalid" for result in results):
+        return fastapi.responses.JSONResponse({"results": results}, status_code=422)
+
+    # Runs outside the thread an X-Profile request profiles, see ProfiledRoute
+    results = await run_in_threadpool(_apply_batch, transaction_store, operations)
+    if any(result["status"] != "ok" for result in results):
+        return fastapi.responses.JSONResponse({"results": results}, status_code=404)
+
+    headers = {"HX-Trigger": "tableUpdate"}
+
+    return fastapi.responses.JSONResponse({"results": results}, headers=headers)
+
+
+app = create_app()
@@ -0,0 +1,328 @@
+"""On-demand profiling of single requests."""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+import copy
+import cProfile
+import dataclasses
+import datetime
+import functools
+import itertools
+import marshal
+import pstats
+import secrets
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterator
+from typing import Any
+
+import fastapi
+from fastapi.routing import APIRoute
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+PROFILE_HEADER = "x-profile"
+ADMIN_TOKEN_HEADER = "x-admin-token"
+PROFILE_MODES = ("deterministic", "sampling")
+SAMPLE_INTERVAL = 0.001
+
+# cProfile hooks the whole interpreter on Python 3.12+ (sys.monitoring) and
+# cannot be enabled twice, so one deterministic profile runs at a time
+_deterministic_lock = threading.Lock()
+
+
+@dataclasses.dataclass(frozen=True)
+class Profile:
+    """Model for the profile of a single request."""
+
+    pid: int
+    method: str
+    path: str
+    mode: str
+    created: datetime.datetime
+    duration: float
+    data: bytes = dataclasses.field(repr=False)
+
+
+@dataclasses.dataclass(frozen=True)
+class _ProfileRequest:
+    """A request the ProfileMiddleware has asked to be profiled."""
+
+    mode: str
+    method: str
+    path: str
+    profiles: ProfileStore
+
+
+_profile_request: contextvars.ContextVar[_ProfileRequest | None]
+_profile_request = contextvars.ContextVar("profile_request", default=None)
+
+
+class ProfileStore:
+    """Ring buffer holding the most recent profiles."""
+
+    def __init__(self, size: int) -> None:
+        """Initialize an empty buffer keeping at most `size` profiles."""
+        self._profiles: collections.deque[Profile] = collections.deque(maxlen=size)
+        self._pids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, request: _ProfileRequest, duration: float, data: bytes) -> None:
+        """Add a profile, dropping the oldest if the buffer is full."""
+        with self._lock:
+            profile = Profile(
+                pid=next(self._pids),
+                method=request.method,
+                path=request.path,
+                mode=request.mode,
+                created=datetime.datetime.now(tz=datetime.timezone.utc),
+                duration=duration,
+                data=data,
+            )
+            self._profiles.append(profile)
+
+    def get(self, pid: int) -> Profile | None:
+        """Get a profile by its ID, None if it has left the buffer."""
+        with self._lock:
+            return next((p for p in self._profiles if p.pid == pid), None)
+
+    def get_all(self) -> list[Profile]:
+        """Get every profile in the buffer, newest first."""
+        with self._lock:
+            return list(reversed(self._profiles))
+
+
+class ProfileMiddleware:
+    """
+    Mark requests carrying the profile header and a valid admin token.
+
+    The header value picks the mode, "deterministic" (cProfile, the default)
+    or "sampling". The profiling itself happens in ProfiledRoute so it runs
+    on the thread executing the endpoint.
+    """
+
+    def __init__(self, app: ASGIApp, admin_token: str, profiles: ProfileStore) -> None:
+        """Initialize the middleware."""
+        self.app = app
+        self.admin_token = admin_token.encode()
+        self.profiles = profiles
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Profile the request if asked to, otherwise pass it through."""
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        mode = headers.get(PROFILE_HEADER.encode())
+        token = headers.get(ADMIN_TOKEN_HEADER.encode(), b"")
+        if mode is None or not secrets.compare_digest(token, self.admin_token):
+            return await self.app(scope, receive, send)
+
+        request = _ProfileRequest(
+            mode=mode.decode() if mode.decode() in PROFILE_MODES else PROFILE_MODES[0],
+            method=scope["method"],
+            path=scope["path"],
+            profiles=self.profiles,
+        )
+        reset = _profile_request.set(request)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _profile_request.reset(reset)
+
+
+class _DeterministicProfiler:
+    """Profile the current thread with cProfile, producing marshalled pstats."""
+
+    data = b""
+
+    def __enter__(self) -> None:
+        """Start profiling."""
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def __exit__(self, *args: Any) -> None:
+        """Stop profiling and collect the stats."""
+        self._profile.disable()
+        stats = pstats.Stats(self._profile)
+        self.data = marshal.dumps(stats.stats)  # type: ignore[attr-defined]
+
+
+class _SamplingProfiler:
+    """Sample the stack of the current thread, producing collapsed stacks."""
+
+    data = b""
+
+    def __enter__(self) -> None:
+        """Start sampling the current thread."""
+        self._stacks: collections.Counter[str] = collections.Counter()
+        self._done = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._sample,
+            args=(threading.get_ident(),),
+            daemon=True,
+        )
+        self._sampler.start()
+
+    def __exit__(self, *args: Any) -> None:
+        """Stop sampling and collapse the counted stacks."""
+        self._done.set()
+        self._sampler.join()
+        stacks = self._stacks.items()
+        self.data = "".join(f"{stack} {count}\n" for stack, count in stacks).encode()
+
+    def _sample(self, thread_id: int) -> None:
+        """Count the stack of `thread_id` every SAMPLE_INTERVAL until done."""
+        while not self._done.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(thread_id)
+            names = []
+            while frame is not None:
+                names.append(f"{frame.f_code.co_filename}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            self._stacks[";".join(reversed(names))] += 1
+
+
+@contextlib.contextmanager
+def _profiling(request: _ProfileRequest) -> Iterator[None]:
+    """
+    Profile the current thread in the requested mode and store the result.
+
+    A deterministic profile requested while another is running falls back to
+    sampling. On Python 3.12+ a deterministic profile also records any other
+    thread running Python code at the time.
+    """
+    profiler: _DeterministicProfiler | _SamplingProfiler
+    deterministic = request.mode == "deterministic"
+    if deterministic and _deterministic_lock.acquire(blocking=False):
+        profiler = _DeterministicProfiler()
+    else:
+        deterministic = False
+        request = dataclasses.replace(request, mode="sampling")
+        profiler = _SamplingProfiler()
+
+    start = time.perf_counter()
+    try:
+        with profiler:
+            yield
+    finally:
+        if deterministic:
+            _deterministic_lock.release()
+        request.profiles.add(request, time.perf_counter() - start, profiler.data)
+
+
+def _profiled(call: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap an endpoint to run under a profiler when its request asks for it."""
+    if asyncio.iscoroutinefunction(call):
+
+        @functools.wraps(call)
+        async def async_wrapper(**values: Any) -> Any:
+            request = _profile_request.get()
+            if request is None:
+                return await call(**values)
+
+            # Only the event loop thread is profiled, so work the endpoint
+            # hands to the threadpool is not captured
+            with _profiling(request):
+                return await call(**values)
+
+        return async_wrapper
+
+    @functools.wraps(call)
+    def wrapper(**values: Any) -> Any:
+        request = _profile_request.get()
+        if request is None:
+            return call(**values)
+
+        with _profiling(request):
+            return call(**values)
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """
+    APIRoute whose endpoint can be profiled on demand by ProfileMiddleware.
+
+    Only the thread running the endpoint is profiled. An async endpoint that
+    hands its work to the threadpool, such as batch_transactions, yields a
+    profile of little more than its request parsing.
+    """
+
+    def get_route_handler(self) -> Callable[[fastapi.Request], Any]:
+        """Build the request handler around a profiled copy of the endpoint."""
+        dependant = self.dependant
+        self.dependant = copy.copy(dependant)
+        self.dependant.call = _profiled(dependant.call)  # type: ignore[arg-type]
+        try:
+            return super().get_route_handler()
+        finally:
+            self.dependant = dependant
+
+
+def _require_admin(request: fastapi.Request) -> None:
+    """
+    Allow only requests carrying the admin token.
+
+    Raises:
+        HTTPException: 404 if no admin token is configured, 403 if it differs
+    """
+    admin_token = request.app.state.settings.admin_token
+    if admin_token is None:
+        raise fastapi.HTTPException(404)
+
+    token = request.headers.get(ADMIN_TOKEN_HEADER, "")
+    if not secrets.compare_digest(token.encode(), admin_token.encode()):
+        raise fastapi.HTTPException(403)
+
+
+admin_router = fastapi.APIRouter(
+    prefix="/admin/profiles",
+    dependencies=[fastapi.Depends(_require_admin)],
+    include_in_schema=False,
+)
+
+
+@admin_router.get("")
+def list_profiles(request: fastapi.Request) -> list[dict[str, Any]]:
+    """Return the profiles held in the ring buffer, newest first."""
+    profiles: ProfileStore = request.app.state.profiles
+    return [
+        {
+            "pid": profile.pid,
+            "method": profile.method,
+            "path": profile.path,
+            "mode": profile.mode,
+            "created": profile.created,
+            "duration": profile.duration,
+        }
+        for profile in profiles.get_all()
+    ]
+
+
+@admin_router.get("/{pid}")
+def download_profile(request: fastapi.Request, pid: int) -> fastapi.Response:
+    """
+    Download a single profile.
+
+    Deterministic profiles are pstats files, load them with pstats.Stats or
+    snakeviz. Sampling profiles are collapsed stacks, one "stack count" per
+    line, ready for flamegraph.pl or speedscope.
+    """
+    profile = request.app.state.profiles.get(pid)
+    if profile is None:
+        raise fastapi.HTTPException(404)
+
+    if profile.mode == "sampling":
+        filename = f"profile-{pid}.collapsed"
+        media_type = "text/plain"
+    else:
+        filename = f"profile-{pid}.pstats"
+        media_type = "application/octet-stream"
+
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    return fastapi.Response(profile.data, media_type=media_type, headers=headers)
@@ -0,0 +1,38 @@
+"""Settings for creating the application."""
+
+from __future__ import annotations
+
+import dataclasses
+import os
+
+ENV_PREFIX = "HTMX_FASTAPI_"
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    """Settings for creating the application."""
+
+    database: str = "transactions.db"
+    template_directory: str = "template"
+    static_directory: str = "static"
+    # Archive transactions older than this many days on startup, None to disable
+    archive_after_days: int | None = None
+    # Token required by the admin endpoints and profiling, None to disable them
+    admin_token: str | None = None
+    # Number of request profiles kept for download
+    profile_history: int = 20
+
+    @classmethod
+    def from_env(cls) -> Settings:
+        """
+        Create settings from HTMX_FASTAPI_<FIELD> environment variables.
+
+        Fields without a variable keep their default.
+        """
+        values: dict[str, str | int] = {}
+        for field in dataclasses.fields(cls):
+            value = os.environ.get(f"{ENV_PREFIX}{field.name.upper()}")
+            if value is not None:
+                values[field.name] = int(value) if "int" in field.type else value
+
+        return cls(**values)  # type: ignore[arg-type]
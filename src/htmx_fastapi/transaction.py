@@ -6,9 +6,9 @@ import dataclasses
 import datetime
 
 
-def _current_date() -> str:
-    """Return the current date as YYYY-MM-DD."""
-    return datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y-%m-%d")
+def _current_date() -> datetime.date:
+    """Return the current UTC date."""
+    return datetime.datetime.now(tz=datetime.timezone.utc).date()
 
 
 @dataclasses.dataclass(frozen=True)
@@ -18,4 +18,16 @@ class Transaction:
     tid: int
     amount: int
     description: str
-    date: str = _current_date()
+    date: datetime.date = _current_date()
+    # Archived transactions are read-only
+    archived: bool = False
+
+
+@dataclasses.dataclass(frozen=True)
+class TransactionChange:
+    """Model for an entry in the transaction change journal."""
+
+    seq: int
+    operation: str
+    tid: int
+    transaction: Transaction | None = None
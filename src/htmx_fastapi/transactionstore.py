@@ -2,61 +2,293 @@
 
 from __future__ import annotations
 
+import datetime
+import functools
 import sqlite3
-from contextlib import closing
+import threading
+from collections.abc import Callable, Iterator
+from contextlib import closing, contextmanager
+from typing import Any, TypeVar
 
-from .transaction import Transaction
+from . import _archive
+from .transaction import Transaction, TransactionChange
+
+# STRICT tables enforce column types and require SQLite 3.37.0+
+_STRICT = " STRICT" if sqlite3.sqlite_version_info >= (3, 37, 0) else ""
+
+# julianday() of the day before 0001-01-01, turning SQL dates into ordinals
+_JULIANDAY_OFFSET = 1721424.5
+
+# INSERT ... RETURNING requires SQLite 3.35.0+, before it each row is inserted
+# on its own to read its lastrowid
+_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Rows per multi-row INSERT, keeping the bound parameters within the limit
+# of 32766 SQLite has used since 3.32.0
+_INSERT_ROWS = 10000 if _RETURNING else 1
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def _to_day(date: datetime.date) -> int:
+    """Return the date as an integer day number."""
+    return date.toordinal()
+
+
+def _from_day(day: int) -> datetime.date:
+    """Return the date of an integer day number."""
+    return datetime.date.fromordinal(day)
+
+
+def _synchronized(method: F) -> F:
+    """Run the method holding the store lock."""
+
+    @functools.wraps(method)
+    def wrapper(self: TransactionStore, *args: Any, **kwargs: Any) -> Any:
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
+
+
+class _BatchState(threading.local):
+    """Batch nesting of the current thread."""
+
+    depth = 0
 
 
 class TransactionStore:
-    """Interface to the Transaction table in the database."""
+    """
+    Interface to the Transaction table in the database.
+
+    The connection is shared by every thread using the store, so each call
+    holds a store-wide lock. An open batch holds it until it exits, keeping
+    other threads from writing into, committing, or reading its transaction.
+    """
 
     def __init__(self, database: sqlite3.Connection) -> None:
         """Initialize the database interface."""
         self.database = database
+        self._lock = threading.RLock()
+        self._batch = _BatchState()
 
         self._create_tables()
 
     def _create_tables(self) -> None:
         """Create the tables in the database."""
+        self._migrate_text_dates()
         self.database.execute(
-            """CREATE TABLE IF NOT EXISTS transactions (
+            f"""CREATE TABLE IF NOT EXISTS transactions (
                 tid INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT,
+                date INTEGER NOT NULL,
                 description TEXT,
                 amount INTEGER
+            ){_STRICT}"""
+        )
+        self.database.execute(
+            """CREATE INDEX IF NOT EXISTS transactions_date
+            ON transactions (date)"""
+        )
+        self.database.execute(
+            """CREATE TABLE IF NOT EXISTS transaction_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                tid INTEGER NOT NULL,
+                operation TEXT NOT NULL
             )"""
         )
+        self.database.execute(
+            """CREATE TABLE IF NOT EXISTS transaction_change_consumers (
+                consumer TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL
+            )"""
+        )
+        self.database.execute(
+            """CREATE TABLE IF NOT EXISTS transaction_change_floor (
+                seq INTEGER NOT NULL
+            )"""
+        )
+        self.database.execute(
+            f"""CREATE TABLE IF NOT EXISTS transaction_archive (
+                block INTEGER PRIMARY KEY AUTOINCREMENT,
+                month TEXT NOT NULL,
+                date_min INTEGER NOT NULL,
+                date_max INTEGER NOT NULL,
+                row_count INTEGER NOT NULL,
+                total_amount INTEGER NOT NULL,
+                codec TEXT NOT NULL,
+                payload BLOB NOT NULL
+            ){_STRICT}"""
+        )
+        self.database.execute(
+            """CREATE INDEX IF NOT EXISTS transaction_archive_dates
+            ON transaction_archive (date_max, date_min)"""
+        )
+        self._merge_archive_months()
+        self.database.execute(
+            """CREATE UNIQUE INDEX IF NOT EXISTS transaction_archive_month
+            ON transaction_archive (month)"""
+        )
+        self._create_change_triggers()
 
-    def add(self, transaction: Transaction) -> None:
-        """Add a transaction to the database."""
-        self.add_batch([transaction])
-
-    def add_batch(self, transactions: list[Transaction]) -> None:
-        """Add a batch of transactions to the database."""
+    def _merge_archive_months(self) -> None:
+        """Merge months archived into several blocks before each had one block."""
         with closing(self.database.cursor()) as cursor:
-            cursor.executemany(
+            cursor.execute(
                 """
-                INSERT INTO transactions (
-                    date,
+                SELECT
+                    month,
+                    MIN(codec)
+                FROM transaction_archive
+                GROUP BY month
+                HAVING COUNT(*) > 1
+                """
+            )
+            months = cursor.fetchall()
+
+        for month, codec in months:
+            self._write_archive_block(month, [], codec)
+        self.database.commit()
+
+    def _migrate_text_dates(self) -> None:
+        """
+        Convert a transactions table storing YYYY-MM-DD text into day numbers.
+
+        The conversion runs in a single transaction. A date SQLite cannot
+        parse fails the migration and leaves the table untouched.
+        """
+        with closing(self.database.cursor()) as cursor:
+            cursor.execute("PRAGMA table_info(transactions)")
+            columns = {row[1]: row[2] for row in cursor.fetchall()}
+
+        if columns.get("date", "INTEGER").upper() == "INTEGER":
+            return
+
+        try:
+            self.database.executescript(
+                f"""
+                BEGIN;
+                ALTER TABLE transactions RENAME TO transactions_text;
+                CREATE TABLE transactions (
+                    tid INTEGER PRIMARY KEY AUTOINCREMENT,
+                    date INTEGER NOT NULL,
+                    description TEXT,
+                    amount INTEGER
+                ){_STRICT};
+                INSERT INTO transactions (tid, date, description, amount)
+                SELECT
+                    tid,
+                    CAST(julianday(date) - {_JULIANDAY_OFFSET} AS INTEGER),
                     description,
                     amount
+                FROM transactions_text;
+                UPDATE sqlite_sequence
+                SET seq = (
+                    SELECT seq FROM sqlite_sequence WHERE name = 'transactions_text'
                 )
-                VALUES (?, ?, ?)""",
-                [
-                    (transaction.date, transaction.description, transaction.amount)
-                    for transaction in transactions
-                ],
+                WHERE name = 'transactions';
+                DROP TABLE transactions_text;
+                COMMIT;
+                """
+            )
+        except sqlite3.Error:
+            self.database.rollback()
+            raise
+
+    def _create_change_triggers(self) -> None:
+        """Create the triggers that journal every change to the transactions."""
+        for operation, event, row in (
+            ("insert", "INSERT", "NEW"),
+            ("update", "UPDATE", "NEW"),
+            ("delete", "DELETE", "OLD"),
+        ):
+            self.database.execute(
+                f"""CREATE TRIGGER IF NOT EXISTS transactions_journal_{operation}
+                AFTER {event} ON transactions
+                BEGIN
+                    INSERT INTO transaction_changes (tid, operation)
+                    VALUES ({row}.tid, '{operation}');
+                END"""
             )
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Apply every write made inside the context in one transaction.
+
+        Writes commit together when the outermost context exits and are all
+        rolled back if it exits with an exception. Other threads using the
+        store block until the outermost context exits.
+        """
+        with self._lock:
+            self._batch.depth += 1
+            try:
+                yield
+            except BaseException:
+                if self._batch.depth == 1:
+                    self.database.rollback()
+                raise
+            else:
+                if self._batch.depth == 1:
+                    self.database.commit()
+            finally:
+                self._batch.depth -= 1
+
+    def _commit(self) -> None:
+        """Commit the current transaction unless this thread has a batch open."""
+        if not self._batch.depth:
             self.database.commit()
 
-    def get(self, date_since: str, date_until: str) -> list[Transaction]:
+    def add(self, transaction: Transaction) -> None:
+        """Add a transaction to the database."""
+        self.add_batch([transaction])
+
+    @_synchronized
+    def add_batch(self, transactions: list[Transaction]) -> list[int]:
+        """Add a batch of transactions to the database, returning their ids."""
+        tids = []
+        with closing(self.database.cursor()) as cursor:
+            for start in range(0, len(transactions), _INSERT_ROWS):
+                chunk = transactions[start : start + _INSERT_ROWS]
+                cursor.execute(
+                    f"""
+                    INSERT INTO transactions (
+                        date,
+                        description,
+                        amount
+                    )
+                    VALUES {", ".join(["(?, ?, ?)"] * len(chunk))}
+                    {"RETURNING tid" if _RETURNING else ""}""",
+                    [
+                        value
+                        for transaction in chunk
+                        for value in (
+                            _to_day(transaction.date),
+                            transaction.description,
+                            transaction.amount,
+                        )
+                    ],
+                )
+                if _RETURNING:
+                    # RETURNING order is unspecified, AUTOINCREMENT ids are not
+                    tids += sorted(row[0] for row in cursor.fetchall())
+                else:
+                    tids.append(cursor.lastrowid or 0)
+            self._commit()
+
+        return tids
+
+    @_synchronized
+    def get(
+        self,
+        date_since: datetime.date,
+        date_until: datetime.date,
+    ) -> list[Transaction]:
         """
         Get transactions in the database.
 
         Args:
-            date_since: The start date as a string in YYYY-MM-DD format
-            date_until: The end date as a string in YYYY-MM-DD format
+            date_since: The first date included
+            date_until: The last date included
         """
         with closing(self.database.cursor()) as cursor:
             cursor.execute(
@@ -70,25 +302,38 @@ class TransactionStore:
                 WHERE date >= ? AND date <= ?
                 ORDER BY date DESC
                 """,
-                (date_since, date_until),
+                (_to_day(date_since), _to_day(date_until)),
             )
-            return [
-                Transaction(
-                    tid=row[0],
-                    amount=row[1],
-                    description=row[2],
-                    date=row[3],
-                )
-                for row in cursor.fetchall()
-            ]
+            rows = cursor.fetchall()
+
+        archived_rows = self._get_archived_rows(date_since, date_until)
+        if archived_rows:
+            rows = sorted(rows + archived_rows, key=lambda row: row[3], reverse=True)
+        archived_tids = {row[0] for row in archived_rows}
+
+        return [
+            Transaction(
+                tid=row[0],
+                amount=row[1],
+                description=row[2],
+                date=_from_day(row[3]),
+                archived=row[0] in archived_tids,
+            )
+            for row in rows
+        ]
 
-    def get_total(self, date_since: str, date_until: str) -> int:
+    @_synchronized
+    def get_total(
+        self,
+        date_since: datetime.date,
+        date_until: datetime.date,
+    ) -> int:
         """
         Get the total amount of transactions in the database.
 
         Args:
-            date_since: The start date as a string in YYYY-MM-DD format
-            date_until: The end date as a string in YYYY-MM-DD format
+            date_since: The first date included
+            date_until: The last date included
         """
         with closing(self.database.cursor()) as cursor:
             cursor.execute(
@@ -98,17 +343,28 @@ class TransactionStore:
                 FROM transactions
                 WHERE date >= ? AND date <= ?
                 """,
-                (date_since, date_until),
+                (_to_day(date_since), _to_day(date_until)),
             )
-            return cursor.fetchone()[0]
+            total = cursor.fetchone()[0]
+
+        archived = self._get_archived_totals(date_since, date_until)
+        if archived is not None:
+            total = (total or 0) + archived[1]
+
+        return total
 
-    def get_count(self, date_since: str, date_until: str) -> int:
+    @_synchronized
+    def get_count(
+        self,
+        date_since: datetime.date,
+        date_until: datetime.date,
+    ) -> int:
         """
         Get the number of transactions in the database.
 
         Args:
-            date_since: The start date as a string in YYYY-MM-DD format
-            date_until: The end date as a string in YYYY-MM-DD format
+            date_since: The first date included
+            date_until: The last date included
         """
         with closing(self.database.cursor()) as cursor:
             cursor.execute(
@@ -118,10 +374,17 @@ class TransactionStore:
                 FROM transactions
                 WHERE date >= ? AND date <= ?
                 """,
-                (date_since, date_until),
+                (_to_day(date_since), _to_day(date_until)),
             )
-            return cursor.fetchone()[0]
+            count = cursor.fetchone()[0]
+
+        archived = self._get_archived_totals(date_since, date_until)
+        if archived is not None:
+            count += archived[0]
+
+        return count
 
+    @_synchronized
     def get_count_all(self) -> int:
         """
         Get the number of transactions in the database.
@@ -130,14 +393,15 @@ class TransactionStore:
             cursor.execute(
                 """
                 SELECT
-                    COUNT(amount)
-                FROM transactions
+                    (SELECT COUNT(amount) FROM transactions)
+                    + (SELECT IFNULL(SUM(row_count), 0) FROM transaction_archive)
                 """,
             )
             return cursor.fetchone()[0]
 
-    def get_by_id(self, transaction_id: int) -> Transaction:
-        """Get a transaction by its ID."""
+    @_synchronized
+    def get_by_id(self, transaction_id: int) -> Transaction | None:
+        """Get a transaction by its ID, None if it is not in the transactions table."""
         with closing(self.database.cursor()) as cursor:
             cursor.execute(
                 """
@@ -152,42 +416,417 @@ class TransactionStore:
                 (transaction_id,),
             )
             row = cursor.fetchone()
+            if row is None:
+                return None
+
             return Transaction(
                 tid=row[0],
                 amount=row[1],
                 description=row[2],
-                date=row[3],
+                date=_from_day(row[3]),
             )
 
-    def update(self, transaction: Transaction) -> None:
-        """Update a transaction in the database."""
+    def update(self, transaction: Transaction) -> bool:
+        """Update a transaction in the database, returning whether it was found."""
+        return self.update_batch([transaction])[0]
+
+    @_synchronized
+    def update_batch(self, transactions: list[Transaction]) -> list[bool]:
+        """
+        Update a batch of transactions in the database.
+
+        Returns whether each transaction was found and updated.
+        """
+        updated = []
+        with closing(self.database.cursor()) as cursor:
+            for transaction in transactions:
+                cursor.execute(
+                    """
+                    UPDATE transactions
+                    SET
+                        date = ?,
+                        description = ?,
+                        amount = ?
+                    WHERE tid = ?
+                    """,
+                    (
+                        _to_day(transaction.date),
+                        transaction.description,
+                        transaction.amount,
+                        transaction.tid,
+                    ),
+                )
+                updated.append(cursor.rowcount == 1)
+            self._commit()
+
+        return updated
+
+    def delete(self, transaction_id: int) -> bool:
+        """Delete a transaction from the database, returning whether it was found."""
+        return self.delete_batch([transaction_id])[0]
+
+    @_synchronized
+    def delete_batch(self, transaction_ids: list[int]) -> list[bool]:
+        """
+        Delete a batch of transactions from the database.
+
+        Returns whether each transaction was found and deleted.
+        """
+        deleted = []
+        with closing(self.database.cursor()) as cursor:
+            for transaction_id in transaction_ids:
+                cursor.execute(
+                    """
+                    DELETE FROM transactions
+                    WHERE tid = ?
+                    """,
+                    (transaction_id,),
+                )
+                deleted.append(cursor.rowcount == 1)
+            self._commit()
+
+        return deleted
+
+    @_synchronized
+    def get_changes(self, since_seq: int) -> list[TransactionChange]:
+        """
+        Get the latest change of each transaction changed after `since_seq`.
+
+        Inserted and updated transactions carry their current row. Deleted
+        transactions carry only their id.
+
+        Args:
+            since_seq: The last change sequence number already seen
+        """
         with closing(self.database.cursor()) as cursor:
             cursor.execute(
                 """
-                UPDATE transactions
-                SET
-                    date = ?,
-                    description = ?,
-                    amount = ?
-                WHERE tid = ?
+                SELECT
+                    c.seq,
+                    c.operation,
+                    c.tid,
+                    t.amount,
+                    t.description,
+                    t.date
+                FROM transaction_changes AS c
+                LEFT JOIN transactions AS t ON t.tid = c.tid
+                WHERE c.seq IN (
+                    SELECT MAX(seq)
+                    FROM transaction_changes
+                    WHERE seq > ?
+                    GROUP BY tid
+                )
+                ORDER BY c.seq
+                """,
+                (since_seq,),
+            )
+            return [
+                TransactionChange(
+                    seq=row[0],
+                    operation=row[1],
+                    tid=row[2],
+                    transaction=(
+                        None
+                        if row[1] == "delete"
+                        else Transaction(
+                            tid=row[2],
+                            amount=row[3],
+                            description=row[4],
+                            date=_from_day(row[5]),
+                        )
+                    ),
+                )
+                for row in cursor.fetchall()
+            ]
+
+    @_synchronized
+    def get_change_seq(self) -> int:
+        """Get the most recent change sequence number, zero if none."""
+        with closing(self.database.cursor()) as cursor:
+            cursor.execute(
+                """
+                SELECT
+                    seq
+                FROM sqlite_sequence
+                WHERE name = 'transaction_changes'
+                """,
+            )
+            row = cursor.fetchone()
+            return row[0] if row else 0
+
+    @_synchronized
+    def get_change_floor(self) -> int:
+        """
+        Get the sequence number up to which the journal has been compacted.
+
+        Consumers behind this point can no longer sync from the journal and
+        must re-read their full range.
+        """
+        with closing(self.database.cursor()) as cursor:
+            cursor.execute("SELECT MAX(seq) FROM transaction_change_floor")
+            return cursor.fetchone()[0] or 0
+
+    @_synchronized
+    def advance_consumer(self, consumer: str, seq: int) -> None:
+        """
+        Record that `consumer` has seen all changes up to `seq`.
+
+        A consumer never moves backwards, nor past the current change sequence.
+        """
+        seq = min(seq, self.get_change_seq())
+        with closing(self.database.cursor()) as cursor:
+            cursor.execute(
+                """
+                INSERT INTO transaction_change_consumers (consumer, seq)
+                VALUES (?, ?)
+                ON CONFLICT (consumer) DO UPDATE
+                SET seq = MAX(seq, excluded.seq)
+                """,
+                (consumer, seq),
+            )
+            self._commit()
+
+    @_synchronized
+    def remove_consumer(self, consumer: str) -> None:
+        """Stop holding journal entries back for `consumer`."""
+        with closing(self.database.cursor()) as cursor:
+            cursor.execute(
+                """
+                DELETE FROM transaction_change_consumers
+                WHERE consumer = ?
+                """,
+                (consumer,),
+            )
+            self._commit()
+
+    @_synchronized
+    def compact_changes(self) -> int:
+        """
+        Remove journal entries that every registered consumer has seen.
+
+        Nothing is removed while no consumers are registered. Returns the
+        number of entries removed.
+        """
+        with closing(self.database.cursor()) as cursor:
+            cursor.execute("SELECT MIN(seq) FROM transaction_change_consumers")
+            seq = cursor.fetchone()[0]
+            if seq is None or seq <= self.get_change_floor():
+                return 0
+
+            cursor.execute("DELETE FROM transaction_changes WHERE seq <= ?", (seq,))
+            removed = cursor.rowcount
+            self._raise_change_floor(seq)
+            self._commit()
+            return removed
+
+    def _raise_change_floor(self, seq: int) -> None:
+        """Move the compaction floor up to `seq`, never down."""
+        with closing(self.database.cursor()) as cursor:
+            cursor.execute(
+                """
+                INSERT INTO transaction_change_floor (seq)
+                SELECT ?
+                WHERE ? > (SELECT IFNULL(MAX(seq), 0) FROM transaction_change_floor)
+                """,
+                (seq, seq),
+            )
+            cursor.execute(
+                "DELETE FROM transaction_change_floor WHERE seq < ?",
+                (seq,),
+            )
+
+    @_synchronized
+    def archive(self, cutoff: datetime.date, codec: str = "zlib") -> int:
+        """
+        Move transactions dated before `cutoff` into compressed month-blocks.
+
+        Archived transactions stay readable through get, get_total, get_count
+        and get_count_all but can no longer be edited or deleted. Archiving
+        is not journaled as a change. Journal entries of the archived rows are
+        dropped and the compaction floor raised past them, so clients that
+        have not seen them resync. Rows of a month already archived are merged
+        into its block. Returns the number of transactions archived.
+
+        Args:
+            cutoff: The first date kept in the transactions table
+            codec: The compression of the blocks, "zlib" or "lzma"
+        """
+        if codec not in _archive.CODECS:
+            raise ValueError(f"Unknown archive codec '{codec}'")
+
+        try:
+            if not self.database.in_transaction:
+                self.database.execute("BEGIN IMMEDIATE")
+            with closing(self.database.cursor()) as cursor:
+                cursor.execute(
+                    """
+                    SELECT
+                        MAX(seq)
+                    FROM transaction_changes
+                    WHERE tid IN (SELECT tid FROM transactions WHERE date < ?)
+                    """,
+                    (_to_day(cutoff),),
+                )
+                archived_seq = cursor.fetchone()[0]
+                cursor.execute(
+                    """
+                    DELETE FROM transaction_changes
+                    WHERE tid IN (SELECT tid FROM transactions WHERE date < ?)
+                    """,
+                    (_to_day(cutoff),),
+                )
+                cursor.execute(
+                    """
+                    SELECT
+                        tid,
+                        amount,
+                        description,
+                        date
+                    FROM transactions
+                    WHERE date < ?
+                    ORDER BY date, tid
+                    """,
+                    (_to_day(cutoff),),
+                )
+                rows = cursor.fetchall()
+                for month, month_rows in _archive.group_by_month(rows).items():
+                    self._write_archive_block(month, month_rows, codec)
+                # Read inside the transaction so only the deletes below follow it
+                seq = self.get_change_seq()
+                cursor.execute(
+                    "DELETE FROM transactions WHERE date < ?",
+                    (_to_day(cutoff),),
+                )
+                cursor.execute(
+                    "DELETE FROM transaction_changes WHERE seq > ?",
+                    (seq,),
+                )
+                if archived_seq is not None:
+                    self._raise_change_floor(archived_seq)
+            self._commit()
+        except BaseException:
+            if not self._batch.depth:
+                self.database.rollback()
+            raise
+
+        return len(rows)
+
+    def _write_archive_block(
+        self,
+        month: str,
+        rows: list[tuple[int, int, str, int]],
+        codec: str,
+    ) -> None:
+        """Replace the blocks of `month` with one holding their rows and `rows`."""
+        with closing(self.database.cursor()) as cursor:
+            cursor.execute(
+                """
+                SELECT
+                    codec,
+                    payload
+                FROM transaction_archive
+                WHERE month = ?
                 """,
+                (month,),
+            )
+            for block_codec, payload in cursor.fetchall():
+                rows = rows + _archive.decode(payload, block_codec)
+            rows = sorted(rows, key=lambda row: (row[3], row[0]))
+
+            cursor.execute("DELETE FROM transaction_archive WHERE month = ?", (month,))
+            cursor.execute(
+                """
+                INSERT INTO transaction_archive (
+                    month,
+                    date_min,
+                    date_max,
+                    row_count,
+                    total_amount,
+                    codec,
+                    payload
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?)""",
                 (
-                    transaction.date,
-                    transaction.description,
-                    transaction.amount,
-                    transaction.tid,
+                    month,
+                    rows[0][3],
+                    rows[-1][3],
+                    len(rows),
+                    sum(row[1] for row in rows),
+                    codec,
+                    _archive.encode(rows, codec),
                 ),
             )
-            self.database.commit()
 
-    def delete(self, transaction_id: int) -> None:
-        """Delete a transaction from the database."""
+    def _get_archived_rows(
+        self,
+        date_since: datetime.date,
+        date_until: datetime.date,
+    ) -> list[tuple[int, int, str, int]]:
+        """Return archived rows between the dates, reading only overlapping blocks."""
+        since, until = _to_day(date_since), _to_day(date_until)
         with closing(self.database.cursor()) as cursor:
             cursor.execute(
                 """
-                DELETE FROM transactions
-                WHERE tid = ?
+                SELECT
+                    codec,
+                    payload
+                FROM transaction_archive
+                WHERE date_max >= ? AND date_min <= ?
                 """,
-                (transaction_id,),
+                (since, until),
             )
-            self.database.commit()
+            blocks = cursor.fetchall()
+
+        return [
+            row
+            for codec, payload in blocks
+            for row in _archive.decode(payload, codec)
+            if since <= row[3] <= until
+        ]
+
+    def _get_archived_totals(
+        self,
+        date_since: datetime.date,
+        date_until: datetime.date,
+    ) -> tuple[int, int] | None:
+        """
+        Return the archived count and total amount between the dates.
+
+        Blocks wholly inside the range are answered from their index entry.
+        Returns None when no archived block overlaps the range.
+        """
+        since, until = _to_day(date_since), _to_day(date_until)
+        with closing(self.database.cursor()) as cursor:
+            cursor.execute(
+                """
+                SELECT
+                    row_count,
+                    total_amount,
+                    codec,
+                    CASE
+                        WHEN date_min >= ? AND date_max <= ? THEN NULL
+                        ELSE payload
+                    END
+                FROM transaction_archive
+                WHERE date_max >= ? AND date_min <= ?
+                """,
+                (since, until, since, until),
+            )
+            blocks = cursor.fetchall()
+
+        if not blocks:
+            return None
+
+        count = total = 0
+        for row_count, total_amount, codec, payload in blocks:
+            if payload is None:
+                count += row_count
+                total += total_amount
+                continue
+
+            for row in _archive.decode(payload, codec):
+                if since <= row[3] <= until:
+                    count += 1
+                    total += row[1]
+
+        return count, total
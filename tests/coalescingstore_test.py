@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import datetime
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from htmx_fastapi._singleflight import SingleFlight
+from htmx_fastapi.coalescingstore import CoalescingTransactionStore
+from htmx_fastapi.transaction import Transaction
+
+OCT_1 = datetime.date(2023, 10, 1)
+OCT_3 = datetime.date(2023, 10, 3)
+
+
+@pytest.fixture
+def mock_store() -> CoalescingTransactionStore:
+    """Return a mock CoalescingTransactionStore."""
+    db = sqlite3.connect(":memory:", check_same_thread=False)
+    store = CoalescingTransactionStore(db)
+    store.add_batch(
+        [
+            Transaction(0, 100, "Mock 1", OCT_1),
+            Transaction(0, 100, "Mock 2", OCT_3),
+        ]
+    )
+    return store
+
+
+def test_single_flight_shares_concurrent_calls() -> None:
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow() -> list[int]:
+        calls.append(1)
+        release.wait(timeout=5)
+        return [42]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(flight.do, "key", slow) for _ in range(8)]
+        while flight.executed + flight.coalesced < 8:
+            time.sleep(0.001)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    assert (flight.executed, flight.coalesced) == (1, 7)
+
+
+def test_single_flight_shares_errors() -> None:
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fail() -> None:
+        release.wait(timeout=5)
+        raise ValueError("boom")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [pool.submit(flight.do, "key", fail) for _ in range(2)]
+        while flight.executed + flight.coalesced < 2:
+            time.sleep(0.001)
+        release.set()
+
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result()
+
+
+def test_single_flight_does_not_cache() -> None:
+    flight = SingleFlight()
+
+    flight.do("key", lambda: 1)
+    result = flight.do("key", lambda: 2)
+
+    assert result == 2
+    assert flight.executed == 2
+
+
+def test_store_reads_pass_through(mock_store: CoalescingTransactionStore) -> None:
+    assert len(mock_store.get(OCT_1, OCT_3)) == 2
+    assert mock_store.get_total(OCT_1, OCT_3) == 200
+    assert mock_store.get_count(OCT_1, OCT_1) == 1
+    assert mock_store.get_count_all() == 2
+    assert mock_store.executed == 4
+
+
+def test_store_write_starts_new_generation(
+    mock_store: CoalescingTransactionStore,
+) -> None:
+    generation = mock_store._generation
+
+    mock_store.delete(1)
+    mock_store.update(Transaction(2, 500, "Mock 2", OCT_3))
+    mock_store.add(Transaction(0, 100, "Mock 3", OCT_3))
+
+    assert mock_store._generation == generation + 3
+    assert mock_store.get_total(OCT_1, OCT_3) == 600
+
+
+def test_store_write_starts_generation_before_commit() -> None:
+    generations: list[int] = []
+
+    class Connection(sqlite3.Connection):
+        store: CoalescingTransactionStore | None = None
+
+        def commit(self) -> None:
+            if self.store is not None:
+                generations.append(self.store._generation)
+            super().commit()
+
+    db = sqlite3.connect(":memory:", factory=Connection)
+    db.store = store = CoalescingTransactionStore(db)
+
+    store.add(Transaction(0, 100, "Mock 1", OCT_1))
+    with store.batch():
+        store.update(Transaction(1, 500, "Mock 1", OCT_1))
+        store.delete(1)
+
+    assert generations == [1, 4]
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import datetime
+import pathlib
+import subprocess
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+from htmx_fastapi.main import create_app
+from htmx_fastapi.settings import Settings
+from htmx_fastapi.transaction import Transaction
+
+# Cumulative microseconds allowed for `import htmx_fastapi.main`, third-party included
+IMPORT_TIME_BUDGET = 2_000_000
+
+
+def _import_time(module: str, cwd: pathlib.Path) -> int:
+    """Return the cumulative import time of `module` in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.split("|")
+        if name.strip() == module and not name.startswith("  "):
+            return int(cumulative)
+
+    raise AssertionError(f"{module} not found in -X importtime output")
+
+
+@pytest.fixture
+def settings(tmp_path: pathlib.Path) -> Settings:
+    """Return settings pointing the database at a temporary file."""
+    return Settings(database=str(tmp_path / "transactions.db"))
+
+
+def test_import_main_within_budget(tmp_path: pathlib.Path) -> None:
+    import_time = _import_time("htmx_fastapi.main", tmp_path)
+
+    assert import_time < IMPORT_TIME_BUDGET
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_create_app_opens_nothing_until_startup(settings: Settings) -> None:
+    create_app(settings)
+
+    assert not pathlib.Path(settings.database).exists()
+
+
+def test_lifespan_opens_store_and_templates(settings: Settings) -> None:
+    app = create_app(settings)
+
+    with TestClient(app) as client:
+        response = client.get("/transaction/rowtotal")
+
+    assert response.status_code == 200
+    assert pathlib.Path(settings.database).exists()
+
+
+def test_invalid_date_is_rejected(settings: Settings) -> None:
+    with TestClient(create_app(settings)) as client:
+        response = client.get("/transaction/table?date_since=2023-13-01")
+
+    assert response.status_code == 422
+
+
+def test_batch_applies_mixed_operations(settings: Settings) -> None:
+    operations = [
+        {"op": "create", "date_time": "2023-10-01", "description": "A", "amount": "1"},
+        {"op": "create", "date_time": "2023-10-02", "description": "B", "amount": "2"},
+        {"op": "update", "tid": 1, "date_time": "", "description": "C", "amount": "3"},
+        {"op": "delete", "tid": 2},
+    ]
+
+    with TestClient(create_app(settings)) as client:
+        response = client.post("/transaction/batch", json={"operations": operations})
+        count = client.app.state.transaction_store.get_count_all()  # type: ignore
+
+    assert response.status_code == 200
+    assert response.headers["HX-Trigger"] == "tableUpdate"
+    assert [r["status"] for r in response.json()["results"]] == ["ok"] * 4
+    assert [r["tid"] for r in response.json()["results"]] == [1, 2, 1, 2]
+    assert count == 1
+
+
+def test_batch_accepts_multi_row_form(settings: Settings) -> None:
+    form = {
+        "op": ["create", "create"],
+        "tid": ["", ""],
+        "date_time": ["2023-10-01", "2023-10-02"],
+        "description": ["A", "B"],
+        "amount": ["1.00", "2.50"],
+    }
+
+    with TestClient(create_app(settings)) as client:
+        response = client.post("/transaction/batch", data=form)
+
+    assert response.status_code == 200
+    assert [r["tid"] for r in response.json()["results"]] == [1, 2]
+
+
+def test_batch_rejects_invalid_rows(settings: Settings) -> None:
+    operations = [
+        {"op": "create", "date_time": "2023-10-01", "description": "A", "amount": "1"},
+        {"op": "update", "tid": "x"},
+    ]
+
+    with TestClient(create_app(settings)) as client:
+        response = client.post("/transaction/batch", json=operations)
+        count = client.app.state.transaction_store.get_count_all()  # type: ignore
+
+    assert response.status_code == 422
+    assert [r["status"] for r in response.json()["results"]] == ["skipped", "invalid"]
+    assert count == 0
+
+
+def test_batch_rolls_back_when_a_row_is_missing(settings: Settings) -> None:
+    operations = [
+        {"op": "create", "date_time": "2023-10-01", "description": "A", "amount": "1"},
+        {"op": "delete", "tid": 99},
+    ]
+
+    with TestClient(create_app(settings)) as client:
+        response = client.post("/transaction/batch", json=operations)
+        count = client.app.state.transaction_store.get_count_all()  # type: ignore
+
+    assert response.status_code == 404
+    assert [r["status"] for r in response.json()["results"]] == [
+        "skipped",
+        "not_found",
+    ]
+    assert count == 0
+
+
+def test_batch_does_not_swallow_store_errors(
+    settings: Settings,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    operations = [{"op": "delete", "tid": 1}]
+
+    def delete_batch(transaction_ids: list[int]) -> list[bool]:
+        raise KeyError("store failure")
+
+    with TestClient(create_app(settings)) as client:
+        store = client.app.state.transaction_store  # type: ignore
+        monkeypatch.setattr(store, "delete_batch", delete_batch)
+
+        with pytest.raises(KeyError):
+            client.post("/transaction/batch", json=operations)
+
+
+def test_acknowledging_changes_never_forces_current_clients_to_resync(
+    settings: Settings,
+) -> None:
+    with TestClient(create_app(settings)) as client:
+        client.post("/transaction/changes/report?seq=1000000")
+        response = client.get("/transaction/changes?since_seq=0")
+
+    assert response.status_code == 200
+    assert response.json()["resync"] is False
+
+
+def test_archived_rows_render_without_edit_controls(settings: Settings) -> None:
+    with TestClient(create_app(settings)) as client:
+        store = client.app.state.transaction_store  # type: ignore
+        store.add(Transaction(0, 100, "Old", datetime.date(2023, 10, 1)))
+        store.archive(datetime.date(2023, 10, 2))
+
+        table = client.get("/transaction/table?date_since=2023-10-01")
+        edit = client.get("/transaction/1/edit")
+        put = client.put(
+            "/transaction/1",
+            data={"date_time": "2023-10-01", "description": "New", "amount": "1"},
+        )
+        delete = client.delete("/transaction/1")
+
+    assert "Archived" in table.text
+    assert "/transaction/1/edit" not in table.text
+    assert (edit.status_code, put.status_code, delete.status_code) == (404, 404, 404)
+
+
+def test_batch_rejects_malformed_and_empty_bodies(settings: Settings) -> None:
+    operations = [
+        {"op": "create", "date_time": "2023-10-01", "description": "A", "amount": "1"},
+        {
+            "op": "create",
+            "date_time": "2023-10-01",
+            "description": "B",
+            "amount": "Inf",
+        },
+        {
+            "op": "create",
+            "date_time": "2023-10-01",
+            "description": "C",
+            "amount": "1e30",
+        },
+        {"op": "create", "date_time": "2023-10-01", "description": {"x": 1}},
+        {"op": "delete", "tid": 0},
+    ]
+
+    with TestClient(create_app(settings)) as client:
+        malformed = client.post(
+            "/transaction/batch",
+            content=b"[{",
+            headers={"content-type": "application/json"},
+        )
+        overflow = client.post("/transaction/batch", json=operations)
+        empty = client.post("/transaction/batch", json=[])
+        empty_form = client.post("/transaction/batch", data={})
+        count = client.app.state.transaction_store.get_count_all()  # type: ignore
+
+    assert malformed.status_code == 422
+    assert overflow.status_code == 422
+    assert [r["status"] for r in overflow.json()["results"]] == [
+        "skipped",
+        "invalid",
+        "invalid",
+        "invalid",
+        "skipped",
+    ]
+    assert (empty.status_code, empty_form.status_code) == (422, 422)
+    assert "HX-Trigger" not in empty.headers
+    assert count == 0
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import pathlib
+import pstats
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+from htmx_fastapi.main import create_app
+from htmx_fastapi.settings import Settings
+
+ADMIN = {"X-Admin-Token": "secret"}
+
+
+@pytest.fixture
+def client(tmp_path: pathlib.Path) -> Iterator[TestClient]:
+    """Return a client for an app with profiling enabled."""
+    settings = Settings(
+        database=str(tmp_path / "transactions.db"),
+        admin_token="secret",
+        profile_history=2,
+    )
+    with TestClient(create_app(settings)) as client:
+        yield client
+
+
+def test_requests_are_not_profiled_by_default(client: TestClient) -> None:
+    client.get("/transaction/rowtotal")
+    client.get("/transaction/rowtotal", headers={"X-Profile": "deterministic"})
+
+    assert client.get("/admin/profiles", headers=ADMIN).json() == []
+
+
+def test_deterministic_profile_is_pstats(
+    client: TestClient,
+    tmp_path: pathlib.Path,
+) -> None:
+    headers = {"X-Profile": "deterministic", **ADMIN}
+    client.get("/transaction/rowtotal", headers=headers)
+
+    profiles = client.get("/admin/profiles", headers=ADMIN).json()
+    download = client.get(f"/admin/profiles/{profiles[0]['pid']}", headers=ADMIN)
+    (tmp_path / "profile.pstats").write_bytes(download.content)
+    stats = pstats.Stats(str(tmp_path / "profile.pstats"))
+
+    assert profiles[0]["path"] == "/transaction/rowtotal"
+    assert profiles[0]["mode"] == "deterministic"
+    assert "get_count_all" in {func[2] for func in stats.stats}  # type: ignore
+
+
+def test_sampling_profile_is_collapsed_stacks(client: TestClient) -> None:
+    headers = {"X-Profile": "sampling", **ADMIN}
+    client.get("/transaction/table", headers=headers)
+
+    profile = client.get("/admin/profiles", headers=ADMIN).json()[0]
+    download = client.get(f"/admin/profiles/{profile['pid']}", headers=ADMIN)
+
+    assert profile["mode"] == "sampling"
+    assert download.headers["content-type"].startswith("text/plain")
+    for line in download.text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+
+
+def test_concurrent_deterministic_profiles_fall_back_to_sampling(
+    client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    barrier = threading.Barrier(2)
+
+    def get_count_all() -> int:
+        barrier.wait(timeout=5)
+        return 0
+
+    store = client.app.state.transaction_store  # type: ignore
+    monkeypatch.setattr(store, "get_count_all", get_count_all)
+    headers = {"X-Profile": "deterministic", **ADMIN}
+
+    with ThreadPoolExecutor(2) as pool:
+        futures = [
+            pool.submit(client.get, "/transaction/rowtotal", headers=headers)
+            for _ in range(2)
+        ]
+        responses = [future.result() for future in futures]
+
+    profiles = client.get("/admin/profiles", headers=ADMIN).json()
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert sorted(profile["mode"] for profile in profiles) == [
+        "deterministic",
+        "sampling",
+    ]
+
+
+def test_profiles_are_a_ring_buffer(client: TestClient) -> None:
+    headers = {"X-Profile": "deterministic", **ADMIN}
+    for _ in range(3):
+        client.get("/transaction/rowtotal", headers=headers)
+
+    profiles = client.get("/admin/profiles", headers=ADMIN).json()
+
+    assert [profile["pid"] for profile in profiles] == [3, 2]
+    assert client.get("/admin/profiles/1", headers=ADMIN).status_code == 404
+
+
+def test_admin_requires_token(client: TestClient) -> None:
+    response = client.get("/admin/profiles", headers={"X-Admin-Token": "wrong"})
+
+    assert response.status_code == 403
+
+
+def test_admin_disabled_without_token(tmp_path: pathlib.Path) -> None:
+    settings = Settings(database=str(tmp_path / "transactions.db"))
+
+    with TestClient(create_app(settings)) as client:
+        response = client.get("/admin/profiles", headers=ADMIN)
+
+    assert response.status_code == 404
@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+import pytest
+
+from htmx_fastapi.settings import Settings
+
+
+def test_from_env_reads_prefixed_variables(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("HTMX_FASTAPI_DATABASE", "other.db")
+    monkeypatch.setenv("HTMX_FASTAPI_ARCHIVE_AFTER_DAYS", "30")
+    monkeypatch.setenv("HTMX_FASTAPI_PROFILE_HISTORY", "5")
+
+    settings = Settings.from_env()
+
+    assert settings.database == "other.db"
+    assert settings.archive_after_days == 30
+    assert settings.profile_history == 5
+    assert settings.admin_token is None
+
+
+def test_from_env_defaults_without_variables(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("HTMX_FASTAPI_DATABASE", raising=False)
+
+    assert Settings.from_env().database == Settings().database
@@ -1,16 +1,25 @@
 from __future__ import annotations
 
+import dataclasses
+import datetime
 import sqlite3
+import threading
 
 import pytest
 
+from htmx_fastapi import transactionstore
+from htmx_fastapi._archive import encode
 from htmx_fastapi.transaction import Transaction
 from htmx_fastapi.transactionstore import TransactionStore
 
+OCT_1 = datetime.date(2023, 10, 1)
+OCT_2 = datetime.date(2023, 10, 2)
+OCT_3 = datetime.date(2023, 10, 3)
+
 MOCK_TRANSACTIONS = [
-    (100, "Mock 1", "2023-10-01"),
-    (100, "Mock 2", "2023-10-02"),
-    (100, "Mock 3", "2023-10-03"),
+    (100, "Mock 1", OCT_1.toordinal()),
+    (100, "Mock 2", OCT_2.toordinal()),
+    (100, "Mock 3", OCT_3.toordinal()),
 ]
 
 
@@ -37,7 +46,7 @@ def test_add_row(mock_store: TransactionStore) -> None:
         tid=0,
         amount=100,
         description="Test",
-        date="2023-10-01",
+        date=OCT_1,
     )
 
     mock_store.add(transaction)
@@ -45,12 +54,12 @@ def test_add_row(mock_store: TransactionStore) -> None:
     cursor = mock_store.database.execute("SELECT * FROM transactions WHERE tid = 4")
     row = cursor.fetchone()
 
-    assert row == (4, "2023-10-01", "Test", 100)
+    assert row == (4, OCT_1.toordinal(), "Test", 100)
 
 
 def test_get_rows(mock_store: TransactionStore) -> None:
-    full_result = mock_store.get("2023-10-01", "2023-10-03")
-    partial_result = mock_store.get("2023-10-01", "2023-10-02")
+    full_result = mock_store.get(OCT_1, OCT_3)
+    partial_result = mock_store.get(OCT_1, OCT_2)
 
     assert len(full_result) == len(MOCK_TRANSACTIONS)
     assert len(partial_result) == len(MOCK_TRANSACTIONS) - 1
@@ -61,7 +70,7 @@ def test_update_row(mock_store: TransactionStore) -> None:
         tid=1,
         amount=42069,
         description="Hello there",
-        date="2023-10-01",
+        date=OCT_1,
     )
 
     mock_store.update(transaction)
@@ -86,19 +95,332 @@ def test_delete_row(mock_store: TransactionStore) -> None:
 def test_get_by_id(mock_store: TransactionStore) -> None:
     transaction = mock_store.get_by_id(1)
 
+    assert transaction is not None
     assert transaction.tid == 1
     assert transaction.amount == 100
     assert transaction.description == "Mock 1"
-    assert transaction.date == "2023-10-01"
+    assert transaction.date == OCT_1
 
 
 def test_get_total_amount_all_mock_data(mock_store: TransactionStore) -> None:
-    total_amount = mock_store.get_total("2023-10-01", "2023-10-03")
+    total_amount = mock_store.get_total(OCT_1, OCT_3)
 
     assert total_amount == 300
 
 
 def test_get_total_amount_single_day(mock_store: TransactionStore) -> None:
-    total_amount = mock_store.get_total("2023-10-01", "2023-10-01")
+    total_amount = mock_store.get_total(OCT_1, OCT_1)
 
     assert total_amount == 100
+
+
+def test_changes_are_journaled(mock_store: TransactionStore) -> None:
+    mock_store.update(Transaction(1, 200, "Mock 1", OCT_1))
+    mock_store.delete(2)
+    mock_store.add(Transaction(0, 300, "Mock 4", OCT_3))
+
+    changes = mock_store.get_changes(0)
+
+    assert [(c.tid, c.operation) for c in changes] == [
+        (3, "insert"),
+        (1, "update"),
+        (2, "delete"),
+        (4, "insert"),
+    ]
+    assert changes[1].transaction == Transaction(1, 200, "Mock 1", OCT_1)
+    assert changes[2].transaction is None
+    assert mock_store.get_change_seq() == 6
+
+
+def test_get_changes_since_seq(mock_store: TransactionStore) -> None:
+    seq = mock_store.get_change_seq()
+    mock_store.delete(3)
+
+    changes = mock_store.get_changes(seq)
+
+    assert len(changes) == 1
+    assert changes[0].tid == 3
+    assert changes[0].seq == seq + 1
+
+
+def test_compact_changes_waits_for_all_consumers(
+    mock_store: TransactionStore,
+) -> None:
+    mock_store.advance_consumer("report", 3)
+    mock_store.advance_consumer("browser", 1)
+
+    assert mock_store.compact_changes() == 1
+    assert mock_store.get_change_floor() == 1
+
+    mock_store.advance_consumer("browser", 3)
+
+    assert mock_store.compact_changes() == 2
+    assert mock_store.get_change_floor() == 3
+    assert mock_store.get_changes(0) == []
+
+
+def test_compact_changes_without_consumers(mock_store: TransactionStore) -> None:
+    assert mock_store.compact_changes() == 0
+    assert len(mock_store.get_changes(0)) == 3
+
+
+def _text_date_database() -> sqlite3.Connection:
+    """Return a database with the YYYY-MM-DD text transactions table."""
+    db = sqlite3.connect(":memory:")
+    db.execute(
+        """CREATE TABLE transactions (
+            tid INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT,
+            description TEXT,
+            amount INTEGER
+        )"""
+    )
+    return db
+
+
+def test_text_dates_are_migrated_to_day_numbers() -> None:
+    db = _text_date_database()
+    db.execute("INSERT INTO transactions VALUES (7, '2023-10-02', 'Old', 100)")
+    db.commit()
+
+    store = TransactionStore(db)
+
+    assert store.get_by_id(7) == Transaction(7, 100, "Old", OCT_2)
+    assert store.get_count(OCT_2, OCT_2) == 1
+    assert store.get_changes(0) == []
+
+
+def test_text_date_migration_rolls_back_on_invalid_date() -> None:
+    db = _text_date_database()
+    db.execute("INSERT INTO transactions VALUES (1, 'not a date', 'Bad', 100)")
+    db.commit()
+
+    with pytest.raises(sqlite3.IntegrityError):
+        TransactionStore(db)
+
+    row = db.execute("SELECT date FROM transactions").fetchone()
+    assert row == ("not a date",)
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma"])
+def test_archive_moves_old_rows_out_of_hot_table(
+    mock_store: TransactionStore,
+    codec: str,
+) -> None:
+    seq = mock_store.get_change_seq()
+
+    archived = mock_store.archive(OCT_3, codec)
+
+    hot = mock_store.database.execute("SELECT tid FROM transactions").fetchall()
+    assert archived == 2
+    assert hot == [(3,)]
+    assert mock_store.get_changes(seq) == []
+
+
+def test_archived_rows_are_read_through(mock_store: TransactionStore) -> None:
+    current = mock_store.get(OCT_1, OCT_3)
+    expected = [current[0]]
+    expected += [dataclasses.replace(row, archived=True) for row in current[1:]]
+
+    mock_store.archive(OCT_3)
+
+    assert mock_store.get(OCT_1, OCT_3) == expected
+    assert mock_store.get(OCT_2, OCT_2) == [expected[1]]
+    assert mock_store.get_total(OCT_1, OCT_3) == 300
+    assert mock_store.get_total(OCT_2, OCT_3) == 200
+    assert mock_store.get_count(OCT_1, OCT_2) == 2
+    assert mock_store.get_count_all() == 3
+
+
+def test_archive_rejects_unknown_codec(mock_store: TransactionStore) -> None:
+    with pytest.raises(ValueError):
+        mock_store.archive(OCT_3, "zip")
+
+    assert mock_store.get_count_all() == 3
+
+
+def test_batch_writes_return_per_row_results(mock_store: TransactionStore) -> None:
+    tids = mock_store.add_batch(
+        [
+            Transaction(0, 100, "Mock 4", OCT_3),
+            Transaction(0, 100, "Mock 5", OCT_3),
+        ]
+    )
+    updated = mock_store.update_batch(
+        [
+            Transaction(1, 500, "Mock 1", OCT_1),
+            Transaction(99, 500, "Missing", OCT_1),
+        ]
+    )
+    deleted = mock_store.delete_batch([2, 99])
+
+    assert tids == [4, 5]
+    assert updated == [True, False]
+    assert deleted == [True, False]
+
+
+def test_batch_commits_once(mock_store: TransactionStore) -> None:
+    mock_store.database.commit()
+
+    with mock_store.batch():
+        mock_store.delete(1)
+        mock_store.add(Transaction(0, 100, "Mock 4", OCT_3))
+
+        assert mock_store.database.in_transaction
+
+    assert not mock_store.database.in_transaction
+    assert mock_store.get_count_all() == 3
+
+
+def test_batch_rolls_back_on_error(mock_store: TransactionStore) -> None:
+    mock_store.database.commit()
+
+    with pytest.raises(RuntimeError):
+        with mock_store.batch():
+            mock_store.delete(1)
+            mock_store.update(Transaction(2, 500, "Mock 2", OCT_2))
+            raise RuntimeError()
+
+    assert mock_store.get_by_id(1) == Transaction(1, 100, "Mock 1", OCT_1)
+    assert mock_store.get_by_id(2) == Transaction(2, 100, "Mock 2", OCT_2)
+
+
+def test_advance_consumer_is_clamped_to_change_seq(
+    mock_store: TransactionStore,
+) -> None:
+    mock_store.advance_consumer("report", 1_000_000)
+    mock_store.compact_changes()
+
+    assert mock_store.get_change_floor() == mock_store.get_change_seq()
+
+
+def test_archive_drops_journal_of_archived_rows(mock_store: TransactionStore) -> None:
+    mock_store.update(Transaction(3, 500, "Mock 3", OCT_3))
+    seq = mock_store.get_change_seq()
+
+    mock_store.archive(OCT_3)
+    changes = mock_store.get_changes(0)
+
+    assert [(c.tid, c.operation) for c in changes] == [(3, "update")]
+    assert mock_store.get_change_floor() == 2
+    assert mock_store.get_changes(seq) == []
+
+
+def test_archive_keeps_writes_open_before_it(mock_store: TransactionStore) -> None:
+    mock_store.database.commit()
+    mock_store.database.execute("UPDATE transactions SET amount = 1 WHERE tid = 3")
+
+    mock_store.archive(OCT_3)
+
+    changes = mock_store.get_changes(0)
+
+    assert [(c.tid, c.operation) for c in changes] == [(3, "update")]
+    assert changes[0].seq == mock_store.get_change_seq() - 2
+
+
+def test_archived_rows_are_marked_and_read_only(mock_store: TransactionStore) -> None:
+    mock_store.archive(OCT_3)
+
+    rows = mock_store.get(OCT_1, OCT_3)
+
+    assert [row.archived for row in rows] == [False, True, True]
+    assert mock_store.get_by_id(1) is None
+    assert mock_store.update(Transaction(1, 500, "Mock 1", OCT_1)) is False
+    assert mock_store.delete(1) is False
+    assert mock_store.delete(3) is True
+
+
+def test_batch_is_isolated_from_other_threads() -> None:
+    store = TransactionStore(sqlite3.connect(":memory:", check_same_thread=False))
+    store.add_batch(
+        [
+            Transaction(0, 100, "Mock 1", OCT_1),
+            Transaction(0, 100, "Mock 2", OCT_2),
+        ]
+    )
+    writer = threading.Thread(
+        target=store.update,
+        args=(Transaction(2, 500, "Mock 2", OCT_2),),
+    )
+
+    with pytest.raises(RuntimeError):
+        with store.batch():
+            store.delete(1)
+            writer.start()
+            writer.join(timeout=0.1)
+            assert writer.is_alive()
+            raise RuntimeError()
+
+    writer.join()
+
+    assert store.get_by_id(1) == Transaction(1, 100, "Mock 1", OCT_1)
+    assert store.get_by_id(2) == Transaction(2, 500, "Mock 2", OCT_2)
+
+
+@pytest.mark.parametrize(
+    ("returning", "rows_per_insert"),
+    [(True, 2), (False, 1)],
+)
+def test_add_batch_returns_ids_across_chunks(
+    mock_store: TransactionStore,
+    monkeypatch: pytest.MonkeyPatch,
+    returning: bool,
+    rows_per_insert: int,
+) -> None:
+    monkeypatch.setattr(transactionstore, "_RETURNING", returning)
+    monkeypatch.setattr(transactionstore, "_INSERT_ROWS", rows_per_insert)
+    transactions = [Transaction(0, amount, "Chunked", OCT_3) for amount in range(5)]
+
+    tids = mock_store.add_batch(transactions)
+
+    assert tids == [4, 5, 6, 7, 8]
+    rows = mock_store.get(OCT_3, OCT_3)
+    assert sorted((row.tid, row.amount) for row in rows)[1:] == list(
+        zip(tids, range(5))
+    )
+
+
+def test_archiving_twice_in_a_month_merges_its_block(
+    mock_store: TransactionStore,
+) -> None:
+    mock_store.archive(OCT_2)
+    mock_store.archive(OCT_3)
+
+    cursor = mock_store.database.execute(
+        "SELECT month, row_count, total_amount FROM transaction_archive"
+    )
+
+    assert cursor.fetchall() == [("2023-10", 2, 200)]
+    assert [row.tid for row in mock_store.get(OCT_1, OCT_3)] == [3, 2, 1]
+    with pytest.raises(sqlite3.IntegrityError):
+        mock_store.database.execute(
+            """
+            INSERT INTO transaction_archive
+            VALUES (NULL, '2023-10', 0, 0, 0, 0, 'zlib', x'')
+            """
+        )
+
+
+def test_duplicate_month_blocks_are_merged_on_open(
+    mock_store: TransactionStore,
+) -> None:
+    mock_store.archive(OCT_2)
+    mock_store.database.execute("DROP INDEX transaction_archive_month")
+    mock_store.database.execute(
+        "INSERT INTO transaction_archive VALUES (NULL, '2023-10', ?, ?, 1, 7, ?, ?)",
+        (
+            OCT_3.toordinal(),
+            OCT_3.toordinal(),
+            "lzma",
+            encode([(9, 7, "Old", OCT_3.toordinal())], "lzma"),
+        ),
+    )
+    mock_store.database.commit()
+
+    store = TransactionStore(mock_store.database)
+    cursor = store.database.execute(
+        "SELECT month, row_count, total_amount FROM transaction_archive"
+    )
+
+    assert cursor.fetchall() == [("2023-10", 2, 107)]
+    assert sorted(row.tid for row in store.get(OCT_1, OCT_3)) == [1, 2, 3, 9]